@@ -1,89 +1,371 @@
+import asyncio
+import os
 import requests
+import numpy as np
 import pandas as pd
 import time
+from operator import itemgetter
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson as _json
+except ImportError:  # Fall back to the stdlib parser
+    import json as _json
+
+try:
+    import aiohttp
+    from asyncio_throttle import Throttler
+except ImportError:  # Without aiohttp, pagination stays serial
+    aiohttp = None
+
+try:
+    import numba
+except ImportError:  # Without numba, grouping uses the numpy path
+    numba = None
+
+try:
+    from tqdm import tqdm
+except ImportError:  # Without tqdm, per-page progress is not shown
+    tqdm = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Without pyarrow, trades are not cached on disk
+    pq = None
+
+_FETCH_ERRORS = (requests.exceptions.RequestException,)
+if aiohttp is not None:
+    _FETCH_ERRORS += (aiohttp.ClientError,)
+
+PAGE_SIZE = 1000
+CACHE_RECENT_US = 3600 * 1_000_000  # Chunks with trades newer than this expire
+CACHE_TTL_S = 3600
+# aggTrades fields kept per trade, with their column dtypes
+COLUMNS = {
+    "a": np.int64,
+    "T": np.int64,
+    "q": np.float64,
+    "p": np.float64,
+    "m": np.bool_
+}
+_get_fields = itemgetter(*COLUMNS)
+SIDES = np.array(["BUY", "SELL"])  # Indexed by the int8 side code
+
+
+def _to_columns(data: list) -> dict:
+    """
+    Convert a parsed aggTrades response into one numpy array per field.
+    """
+    # One C-level itemgetter call per trade, transposed into per-field tuples.
+    # Quantities and prices arrive as decimal strings; numpy parses each
+    # tuple in C rather than calling float() per trade.
+    fields = tuple(zip(*map(_get_fields, data))) or ((),) * len(COLUMNS)
+    return {name: np.asarray(values, dtype=dtype) for (name, dtype), values in zip(COLUMNS.items(), fields)}
+
+
+def _slice_columns(columns: dict, lo: int, hi: int) -> dict:
+    return {name: values[lo:hi] for name, values in columns.items()}
+
+
+class RateLimiter:
+    """
+    Token bucket limiting request weight per second. acquire() only sleeps
+    when the bucket has run dry, so slow responses cost no extra latency.
+    """
+
+    def __init__(self, capacity: float = 10, refill_per_s: float = 10):
+        self.capacity = capacity
+        self.refill_per_s = refill_per_s
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def acquire(self, weight: float = 1):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_s)
+        self.updated_at = now
+
+        if self.tokens < weight:
+            time.sleep((weight - self.tokens) / self.refill_per_s)
+            self.tokens = weight
+            self.updated_at = time.monotonic()
+        self.tokens -= weight
+
+
+if numba is not None:
+    @numba.njit(parallel=True, cache=True)
+    def _top_groups(T, is_sell, btc, usdt, n):
+        """
+        Sum BTC and USDT amounts per (timestamp, side) group and return the n
+        groups with the largest USDT sum, plus the total number of groups.
+        T must be sorted, so every timestamp is one contiguous run; runs are
+        summed in parallel and the top n are kept in a size-n min-heap.
+        """
+        boundaries = np.nonzero(T[1:] != T[:-1])[0] + 1
+        bounds = np.concatenate((np.zeros(1, dtype=np.int64), boundaries, np.full(1, len(T), dtype=np.int64)))
+        runs = len(bounds) - 1
+
+        # Slot 2 * run + side holds the sums for that run's BUY or SELL group
+        sums_btc = np.zeros(2 * runs)
+        sums_usdt = np.zeros(2 * runs)
+        counts = np.zeros(2 * runs, dtype=np.int64)
+        for r in numba.prange(runs):
+            for i in range(bounds[r], bounds[r + 1]):
+                slot = 2 * r + (1 if is_sell[i] else 0)
+                sums_btc[slot] += btc[i]
+                sums_usdt[slot] += usdt[i]
+                counts[slot] += 1
+
+        heap_vals = np.empty(max(n, 0))
+        heap_slots = np.empty(max(n, 0), dtype=np.int64)
+        heap_size = 0
+        group_count = 0
+        for slot in range(2 * runs):
+            if counts[slot] == 0:
+                continue
+            group_count += 1
+            value = sums_usdt[slot]
+            if heap_size < n:
+                # Sift the new value up from the end of the heap
+                j = heap_size
+                heap_size += 1
+                while j > 0 and heap_vals[(j - 1) // 2] > value:
+                    heap_vals[j] = heap_vals[(j - 1) // 2]
+                    heap_slots[j] = heap_slots[(j - 1) // 2]
+                    j = (j - 1) // 2
+            elif n > 0 and value > heap_vals[0]:
+                # Replace the smallest value and sift it down from the root
+                j = 0
+                while 2 * j + 1 < n:
+                    child = 2 * j + 1
+                    if child + 1 < n and heap_vals[child + 1] < heap_vals[child]:
+                        child += 1
+                    if heap_vals[child] >= value:
+                        break
+                    heap_vals[j] = heap_vals[child]
+                    heap_slots[j] = heap_slots[child]
+                    j = child
+            else:
+                continue
+            heap_vals[j] = value
+            heap_slots[j] = slot
+
+        top = heap_slots[:heap_size]
+        return T[bounds[top // 2]], top % 2 == 1, sums_btc[top], sums_usdt[top], group_count
 
 
 class BinanceLargeTradesAnalyzer:
-    def __init__(self):
+    def __init__(self, cache_dir: str = "~/.btc_cache", verbose: bool = False):
         self.base_url = "https://api.binance.com/api/v3"
+        # Print samples of intermediate DataFrames
+        self.verbose = verbose
         self.headers = {
             "X-MBX-TIME-UNIT": "microsecond"  # Ensure microsecond precision
         }
+        # Reuse pooled connections across paginated requests
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=16,
+            max_retries=Retry(total=3, backoff_factor=0.2)
+        ))
+        # aggTrades has weight 1; stay within 10 requests per second
+        self.rate_limiter = RateLimiter(capacity=10, refill_per_s=10)
+        # Parquet cache of fetched pages; None disables caching
+        self.cache_dir = os.path.expanduser(cache_dir) if cache_dir and pq is not None else None
 
-    def get_trades(self, symbol: str, start_time: int, end_time: int) -> list:
+    def get_trades(self, symbol: str, start_time: int, end_time: int) -> dict:
         """
         Fetch all trades from Binance API within the specified time range.
-        Uses trade IDs for pagination and ensures microsecond precision.
+        Resolves the aggregate trade ID range for the window, then fetches it
+        by trade ID with microsecond precision.
+        Returns one numpy array per aggTrades field ("a", "T", "q", "p", "m").
         """
-        endpoint = f"{self.base_url}/aggTrades"
-        trades = []
+        try:
+            first_id = self._find_first_id(symbol, start_time)
+            if first_id is None:
+                print("No trades found after start time")
+                return _to_columns([])
+
+            next_id = self._find_first_id(symbol, end_time + 1)
+            last_id = next_id - 1 if next_id is not None else self._find_latest_id(symbol)
+            if last_id < first_id:
+                print("No trades found in time range")
+                return _to_columns([])
+            print(f"Trade ID range: {first_id} to {last_id}")
+
+            trades = self._fetch_id_range(symbol, first_id, last_id)
 
-        # Initial request with startTime
-        params = {
+        except _FETCH_ERRORS as e:
+            print(f"Error fetching trades: {e}")
+            return _to_columns([])
+
+        # Trades are sorted by time, so clamp to our time range (using
+        # microsecond timestamps) with a binary search instead of a full scan
+        lo, hi = np.searchsorted(trades["T"], [start_time, end_time + 1])
+        trades = _slice_columns(trades, lo, hi)
+        print(f"\nTotal trades fetched and filtered: {len(trades['T'])}")
+        return trades
+
+    def _find_first_id(self, symbol: str, ts: int):
+        """
+        Return the aggregate trade ID of the first trade at or after ts,
+        or None if no such trade exists yet.
+        """
+        data = self._get_agg_trades({
+            "symbol": symbol,
+            "startTime": ts,
+            "limit": 1
+        })
+        return data[0]["a"] if data else None
+
+    def _find_latest_id(self, symbol: str) -> int:
+        """
+        Return the aggregate trade ID of the most recent trade.
+        """
+        data = self._get_agg_trades({
             "symbol": symbol,
-            "startTime": start_time,
-            "limit": 1000
+            "limit": 1
+        })
+        return data[-1]["a"]
+
+    def _get_agg_trades(self, params: dict) -> list:
+        self.rate_limiter.acquire(weight=1)
+        response = self.session.get(f"{self.base_url}/aggTrades", params=params, headers=self.headers)
+        response.raise_for_status()
+        return _json.loads(response.content)
+
+    def _fetch_id_range(self, symbol: str, first_id: int, last_id: int) -> dict:
+        """
+        Fetch all trades with IDs in [first_id, last_id]. Pages of 1000 trades
+        are aligned to 1000-ID boundaries so they can be cached and reused
+        across runs; only pages missing from the cache are requested.
+        """
+        from_ids = range(first_id // PAGE_SIZE * PAGE_SIZE, last_id + 1, PAGE_SIZE)
+        pages = {from_id: self._read_cached_page(symbol, from_id) for from_id in from_ids}
+
+        # The page holding last_id is cut at last_id by the server, so no
+        # trades past end_time are downloaded or parsed
+        missing = {
+            from_id: min(PAGE_SIZE, last_id - from_id + 1)
+            for from_id, page in pages.items() if page is None
         }
+        print(f"Pages cached: {len(pages) - len(missing)}, to fetch: {len(missing)}")
+        if missing:
+            for from_id, page in zip(missing, self._fetch_pages_http(symbol, missing)):
+                page = _slice_columns(page, 0, np.searchsorted(page["a"], from_id + PAGE_SIZE))
+                pages[from_id] = page
+                self._write_cached_page(symbol, from_id, page)
+
+        # Pages are kept in fromId order, so trades stay sorted by time. Trades
+        # outside [first_id, last_id] (from the aligned first page, or a cached
+        # last page) fall outside the time range and are clamped by get_trades.
+        return {name: np.concatenate([page[name] for page in pages.values()]) for name in COLUMNS}
+
+    def _fetch_pages_http(self, symbol: str, limits: dict) -> list:
+        """
+        Request one page of trades per fromId, with the given limit per page,
+        concurrently when aiohttp is available.
+        """
+        progress = tqdm(desc="aggTrades", unit=" trades") if tqdm is not None else None
 
         try:
-            request_count = 0
-            while True:
-                response = requests.get(endpoint, params=params, headers=self.headers)
-                response.raise_for_status()
-                data = response.json()
+            if aiohttp is not None:
+                pages = asyncio.run(self._fetch_pages(symbol, limits, progress))
+            else:
+                pages = [self._fetch_page(symbol, from_id, limit, progress) for from_id, limit in limits.items()]
+        finally:
+            if progress is not None:
+                progress.close()
+        print(f"Fetched {len(pages)} pages")
+        return pages
 
-                if not data:
-                    break
+    def _fetch_page(self, symbol: str, from_id: int, limit: int, progress) -> dict:
+        # Convert each response as soon as it is parsed so the list of
+        # per-trade dicts is dropped before the next page is requested
+        page = _to_columns(self._get_agg_trades({
+            "symbol": symbol,
+            "fromId": from_id,
+            "limit": limit
+        }))
+        if progress is not None:
+            progress.update(len(page["a"]))
+        return page
 
-                trades.extend(data)
-                request_count += 1
+    def _cache_path(self, symbol: str, from_id: int) -> str:
+        return os.path.join(self.cache_dir, symbol, f"{from_id}-{from_id + PAGE_SIZE - 1}.parquet")
 
-                # Print progress with microsecond timestamp
-                print(f"Request {request_count}: Fetched {len(data)} trades. Last timestamp (μs): {data[-1]['T']}")
+    def _read_cached_page(self, symbol: str, from_id: int):
+        """
+        Return the cached page starting at from_id, or None if it is missing
+        or expired. Historical pages never expire; pages holding trades from
+        the last hour before they were written expire after CACHE_TTL_S.
+        """
+        if self.cache_dir is None:
+            return None
+        path = self._cache_path(symbol, from_id)
+        if not os.path.exists(path):
+            return None
 
-                # Stop if we've reached the end time
-                if data[-1]["T"] >= end_time:
-                    break
+        written_at = os.path.getmtime(path)
+        table = pq.read_table(path, columns=list(COLUMNS))
+        page = {name: table.column(name).to_numpy() for name in COLUMNS}
+        if page["T"][-1] > written_at * 1_000_000 - CACHE_RECENT_US and time.time() - written_at > CACHE_TTL_S:
+            return None
+        return page
 
-                # Use fromId parameter for the next request
-                params = {
-                    "symbol": symbol,
-                    "fromId": data[-1]["a"] + 1,
-                    "limit": 1000
-                }
+    def _write_cached_page(self, symbol: str, from_id: int, page: dict):
+        # Only complete pages are cached; a partial page is still being filled
+        if self.cache_dir is None or len(page["a"]) < PAGE_SIZE:
+            return
+        path = self._cache_path(symbol, from_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        table = pa.table(page)
+        pq.write_table(table, path, compression="zstd")
 
-                # Respect rate limits
-                time.sleep(0.15)
+    async def _fetch_pages(self, symbol: str, limits: dict, progress) -> list:
+        endpoint = f"{self.base_url}/aggTrades"
+        # Bound in-flight requests and stay under Binance's request weight budget
+        semaphore = asyncio.Semaphore(8)
+        throttler = Throttler(rate_limit=10, period=1)
 
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching trades: {e}")
-            return []
+        async def fetch(session, from_id, limit):
+            params = {
+                "symbol": symbol,
+                "fromId": from_id,
+                "limit": limit
+            }
+            async with semaphore, throttler:
+                async with session.get(endpoint, params=params) as response:
+                    response.raise_for_status()
+                    page = _to_columns(_json.loads(await response.read()))
+            if progress is not None:
+                progress.update(len(page["a"]))
+            return page
 
-        # Filter trades within our time range (using microsecond timestamps)
-        trades = [trade for trade in trades if start_time <= trade["T"] <= end_time]
-        print(f"\nTotal trades fetched and filtered: {len(trades)}")
-        return trades
+        async with aiohttp.ClientSession(headers=self.headers) as session:
+            return await asyncio.gather(*(fetch(session, from_id, limit) for from_id, limit in limits.items()))
 
-    def process_trades(self, trades: list) -> pd.DataFrame:
+    def process_trades(self, trades: dict) -> pd.DataFrame:
         """
-        Process raw trades data into required format.
+        Process columnar trades data into required format.
         Timestamps are in microseconds.
         """
-        processed_trades = []
+        q = trades["q"].astype(np.float64, copy=False)
 
-        for trade in trades:
-            side = "SELL" if trade["m"] else "BUY"
+        # Typed arrays back the columns directly; copy=False skips the copy
+        # pandas otherwise makes of dict input
+        df = pd.DataFrame({
+            "T": trades["T"].astype(np.int64, copy=False),
+            "amount_btc": q,
+            "amount_usdt": q * trades["p"].astype(np.float64, copy=False),
+            "side": trades["m"].astype(np.int8)  # 0 = BUY, 1 = SELL (buyer is maker)
+        }, copy=False)
 
-            processed_trades.append({
-                "T": trade["T"],  # Timestamp in microseconds
-                "amount_btc": float(trade["q"]),
-                "amount_usdt": float(trade["q"]) * float(trade["p"]),
-                "side": side
-            })
-
-        df = pd.DataFrame(processed_trades)
-        print("\nSample of processed trades with microsecond timestamps:")
-        print(df.head())
+        if self.verbose:
+            print("\nSample of processed trades with microsecond timestamps:")
+            print(df.head())
         return df
 
     def find_largest_trades(self, df: pd.DataFrame, n: int = 5) -> pd.DataFrame:
@@ -91,19 +373,58 @@ class BinanceLargeTradesAnalyzer:
         Find n largest trades by USDT amount.
         Groups trades by microsecond timestamp and side.
         """
-        # Group trades that occur in the same microsecond and side
-        grouped = df.groupby(['T', 'side']).agg({
-            'amount_btc': 'sum',
-            'amount_usdt': 'sum'
-        }).reset_index()
+        if numba is not None:
+            top, group_count = self._top_groups_jit(df, n)
+        else:
+            top, group_count = self._top_groups_numpy(df, n)
 
         # Print grouping info
         print("\nTrade grouping summary:")
         print(f"Original trades: {len(df)}")
-        print(f"After grouping by microsecond and side: {len(grouped)}")
+        print(f"After grouping by microsecond and side: {group_count}")
+
+        return top.sort_values('amount_usdt', ascending=False)
+
+    def _top_groups_jit(self, df: pd.DataFrame, n: int):
+        T = df['T'].to_numpy(dtype=np.int64)
+        is_sell = df['side'].to_numpy(dtype=np.bool_)
+        btc = df['amount_btc'].to_numpy(dtype=np.float64)
+        usdt = df['amount_usdt'].to_numpy(dtype=np.float64)
+
+        # The kernel relies on trades being in time order, as the API returns them
+        if len(T) and (np.diff(T) < 0).any():
+            sorter = np.argsort(T, kind='stable')
+            T, is_sell, btc, usdt = T[sorter], is_sell[sorter], btc[sorter], usdt[sorter]
+
+        top_T, top_sell, top_btc, top_usdt, group_count = _top_groups(T, is_sell, btc, usdt, n)
+        top = pd.DataFrame({
+            'T': top_T,
+            'side': top_sell.astype(np.int8),
+            'amount_btc': top_btc,
+            'amount_usdt': top_usdt
+        })
+        return top, group_count
+
+    def _top_groups_numpy(self, df: pd.DataFrame, n: int):
+        # Group trades that occur in the same microsecond and side. Sorting on
+        # a composite (T, side) key puts each group in one contiguous run,
+        # which is then summed in a single pass.
+        keys = df['T'].values.astype(np.int64) * 2 + df['side'].values
+        sorter = np.argsort(keys, kind='stable')
+        keys = keys[sorter]
+        starts = np.flatnonzero(np.diff(keys, prepend=-1))
+
+        grouped = pd.DataFrame({
+            'T': keys[starts] // 2,
+            'side': (keys[starts] % 2).astype(np.int8),
+            'amount_btc': np.add.reduceat(df['amount_btc'].values[sorter], starts),
+            'amount_usdt': np.add.reduceat(df['amount_usdt'].values[sorter], starts)
+        })
 
-        # Sort by USDT amount and get top n
-        return grouped.nlargest(n, 'amount_usdt')
+        # Select the top n by USDT amount in linear time; only those get sorted
+        if n < len(grouped):
+            grouped = grouped.iloc[np.argpartition(-grouped['amount_usdt'].values, n)[:n]]
+        return grouped, len(starts)
 
 
 def main():
@@ -124,15 +445,12 @@ def main():
     largest_trades = analyzer.find_largest_trades(df)
 
     # Format output
-    formatted_trades = largest_trades.apply(
-        lambda x: {
-            'timestamp_us': int(x['T']),
-            'amount_btc': round(x['amount_btc'], 3),
-            'amount_usdt': round(x['amount_usdt'], 3),
-            'side': x['side']
-        },
-        axis=1
-    ).tolist()
+    formatted_trades = largest_trades[['T', 'amount_btc', 'amount_usdt']].round({
+        'amount_btc': 3,
+        'amount_usdt': 3
+    }).rename(columns={'T': 'timestamp_us'}).assign(
+        side=SIDES[largest_trades['side'].values]
+    ).to_dict(orient='records')
 
     # Print results in required format
     print("\nTop 5 BTC/USDT Taker Trades:")